@@ -0,0 +1,39 @@
+"""Header renaming must match what ``pd.read_excel`` produced before.
+
+``app.py`` is a Streamlit script that runs its UI on import, so the helper
+is compiled on its own from the module source.
+"""
+import ast
+from pathlib import Path
+
+APP = Path(__file__).resolve().parents[1] / "app.py"
+
+
+def _load(name):
+    tree = ast.parse(APP.read_text(encoding="utf-8"))
+    node = next(n for n in tree.body if isinstance(n, ast.FunctionDef) and n.name == name)
+    namespace = {}
+    exec(compile(ast.Module(body=[node], type_ignores=[]), str(APP), "exec"), namespace)
+    return namespace[name]
+
+
+_dedupe_header = _load("_dedupe_header")
+
+
+def test_unique_names_are_unchanged():
+    assert _dedupe_header(["Store Number", "A1", 1001]) == ["Store Number", "A1", 1001]
+
+
+def test_repeated_codes_get_numbered_suffixes():
+    assert _dedupe_header(["A1", "A2", "A1", "A1"]) == ["A1", "A2", "A1.1", "A1.2"]
+
+
+def test_suffix_used_by_a_real_header_is_skipped():
+    assert _dedupe_header(["IT1", "IT2", "IT1", "IT1.1", "IT1"]) == [
+        "IT1", "IT2", "IT1.2", "IT1.1", "IT1.3",
+    ]
+
+
+def test_mixed_int_and_str_duplicates():
+    # A code stored once as a number and once as text used to loop forever
+    assert _dedupe_header([1001, 1001, "1001", "1001"]) == [1001, "1001.1", "1001", "1001.2"]